@@ -40,12 +40,22 @@ When the user is finally satisfied with the new store, the estimated flow
 data is saved to appropriate files.
 """
 
+import functools
+
 import retailmodel
-import csv
 import geopandas as gpd
 import pandas as pd
 import matplotlib.pyplot as plt
-import shapely.geometry
+from matplotlib.colors import BoundaryNorm
+import mapclassify
+
+try:
+	# pyogrio reads shapefiles in bulk arrays rather than one feature at
+	# a time; fall back to the default engine if it is not installed
+	import pyogrio # noqa: F401
+	gpd.options.io_engine = 'pyogrio'
+except ImportError:
+	pass
 
 
 brands = []
@@ -68,78 +78,49 @@ deterrence parameter through the OAC number.
 Stores, DemandZones, Brands and OAC objects are instantiated and stored
 in lists.
 """
-# Read the brands data
-with open('brands.csv', 'r') as csv_file:
-	csv_reader = csv.reader(csv_file)
-	brands_data = []
-	for row in csv_reader:
-		brands_data.append(row)
-
-
-# Instantiate Brands and populate brands list
-for i in range(len(brands_data)):
-	if i > 0: # Ignore header row
-		# Instantiate brands
-		brands.append(retailmodel.Brands(name=brands_data[i][0],
-					  alpha=brands_data[i][1], obs_shares=brands_data[i][2]))
-		# Populate alphas dictionary
-		alphas[str(brands_data[i][0])] = float(brands_data[i][1])
-
-
-# Read the demand data
-with open('demand.csv', 'r') as csv_file:
-	csv_reader = csv.reader(csv_file)
-	demand_data = []
-	for row in csv_reader:
-		demand_data.append(row)
-
-
-#Instantiate DemandZones objects and populate demand_zones list
-for i in range(len(demand_data)):
-	if i > 0: # Ignore header row
-		zone = retailmodel.DemandZones(OA11CD=demand_data[i][0],
-									   expenditure=demand_data[i][1],
-									   oac=demand_data[i][2],
-									   c_easting=demand_data[i][3],
-									   c_northing=demand_data[i][4])
-		demand_zones.append(zone)
-
-
-# Read the OAC data
-with open('oac.csv', 'r') as csv_file:
-	csv_reader = csv.reader(csv_file)
-	oac_data = []
-	for row in csv_reader:
-		oac_data.append(row)
-
-
-# Instantiate OAC objects and populate oac list
-for i in range(len(oac_data)):
-	if i > 0: # Ignore header row
-		oa_class = retailmodel.OAC(class_no=oac_data[i][0],
-							       name=oac_data[i][1], beta=oac_data[i][2])
-		# Populate betas
-		oac.append(oa_class)
-		betas[str(oac_data[i][0])] = float(oac_data[i][2])
-
-
-# Read the stores data
-with open('stores.csv', 'r') as csv_file:
-	csv_reader = csv.reader(csv_file)
-	stores_data = []
-	for row in csv_reader:
-		stores_data.append(row)
-
-
-# Instantiate Stores objects and populate stores list
-for i in range(len(stores_data)):
-	if i > 0: # Ignore header row
-		store = retailmodel.Stores(name=stores_data[i][0],
-								   brand=stores_data[i][1],
-								   easting=stores_data[i][2],
-								   northing=stores_data[i][3],
-								   footage=stores_data[i][4],)
-		stores.append(store)
+# Read the brands data, instantiate Brands and populate the brands list
+brands_df = pd.read_csv('brands.csv', dtype={'Alpha': float})
+for name, alpha, obs_shares in brands_df.itertuples(index=False):
+	brands.append(retailmodel.Brands(name=name, alpha=alpha,
+									 obs_shares=obs_shares))
+	# Populate alphas dictionary
+	alphas[name] = alpha
+
+
+# Read the OAC data, instantiate OAC objects and populate the oac list.
+# This happens before the demand data is read so each DemandZones object
+# can cache its beta at construction
+oac_df = pd.read_csv('oac.csv', dtype={'OAC': str, 'beta': float})
+for class_no, class_name, beta in oac_df.itertuples(index=False):
+	oac.append(retailmodel.OAC(class_no=class_no, name=class_name, beta=beta))
+	# Populate betas
+	betas[class_no] = beta
+
+
+# Read the demand data, instantiate DemandZones and populate the
+# demand_zones list. The fields come out of read_csv already typed, so
+# the constructors assign them as-is
+demand_df = pd.read_csv('demand.csv', dtype={'Expenditure': float,
+											 'OAC': str,
+											 'C_Easting': float,
+											 'C_Northing': float})
+for OA11CD, expenditure, oac_class, c_easting, c_northing in \
+		demand_df.itertuples(index=False):
+	zone = retailmodel.DemandZones(OA11CD=OA11CD, expenditure=expenditure,
+								   oac=oac_class, c_easting=c_easting,
+								   c_northing=c_northing,
+								   beta=betas[oac_class])
+	demand_zones.append(zone)
+
+
+# Read the stores data, instantiate Stores and populate the stores list
+stores_df = pd.read_csv('stores.csv', dtype={'Easting': float,
+											 'Northing': float,
+											 'Footage': int})
+for name, brand, easting, northing, footage in stores_df.itertuples(
+		index=False):
+	stores.append(retailmodel.Stores(name=name, brand=brand, easting=easting,
+									 northing=northing, footage=footage))
 
 
 
@@ -147,11 +128,26 @@ for i in range(len(stores_data)):
 """
 Compute the Flows Matrix.
 
-The Flows Matrix is computed using the retailmodel.DemandZones.comp_flow()
-method which returns a tuple. Refer to the retailmodel.py module
+The supply side is first gathered into a retailmodel.StoreTable, which
+holds the numeric store attributes in NumPy arrays. The Flows Matrix is
+then computed using the retailmodel.DemandZones.comp_flow() method.
+Refer to the retailmodel.py module
 """
-df_flow = retailmodel.DemandZones.comp_flow(demand_zones, stores, alphas,
-											betas)
+store_table = retailmodel.StoreTable(stores, alphas)
+
+df_flow = retailmodel.DemandZones.comp_flow(demand_zones, store_table,
+											alphas, betas)
+
+
+@functools.lru_cache(maxsize=32)
+def new_store_num(easting, northing, brand, footage):
+	"""
+	Return the numerator column of a candidate store, memoized on its
+	(easting, northing, brand, footage) signature so retrying a store
+	the user already tried skips the per-zone recompute.
+	"""
+	return retailmodel.comp_store_num(df_flow, easting, northing, brand,
+									  footage, alphas)
 
 
 
@@ -162,9 +158,10 @@ df_flow = retailmodel.DemandZones.comp_flow(demand_zones, stores, alphas,
 """
 Map the Suppy and Demand Side Data.
 
-First, a pandas DataFrame is created, containing the stores data. Then, the
-coordinate values are used to create shapely point objects; and finally the
-DataFrame is converted to a GeoDataFrame to be plotted. A markersize column
+First, a pandas DataFrame is created, containing the stores data. The
+coordinate values are then turned into point geometry in one vectorized
+call and the DataFrame is converted to a GeoDataFrame to be plotted. A
+markersize column
 is computed from the footage column and used to plot stores in proportion to
 their floorspace.
 
@@ -174,51 +171,46 @@ symbolized according to their spend.
 
 """
 
-# Get the relavent stores data in a list
-stores_list = []
-for store in stores:
-	name = store.name
-	brand = store.brand
-	easting = store.easting
-	northing = store.northing
-	footage = store.footage
-
-	geo_store = [name, brand, easting, northing, footage]
-
-	stores_list.append(geo_store)
-
-
 # Define attribute field names
 store_attr = ['name', 'brand', 'easting', 'northing', 'footage']
 
-# Construct a DataFrame object from the stores_list list
-df_stores = pd.DataFrame(stores_list, columns=store_attr)
-
-# Create a 'Coordinates' tuple from the easting and nothing values
-df_stores['Coordinates'] = list(zip(df_stores.easting, df_stores.northing))
-
-# Convert the 'Coordinates' tuples to point geometry
-df_stores['Coordinates'] = (
-	df_stores['Coordinates'].apply(shapely.geometry.Point))
-
-# Construct a GeoDataFrame from df_stores
-geo_stores = gpd.GeoDataFrame(df_stores, geometry='Coordinates')
+# Construct a DataFrame object straight from the StoreTable arrays
+df_stores = pd.DataFrame(dict(zip(store_attr, [store_table.names,
+				store_table.brand, store_table.easting,
+				store_table.northing, store_table.footage])))
+
+# Construct a GeoDataFrame from df_stores, building the point geometry
+# for all stores in one vectorized call
+geo_stores = gpd.GeoDataFrame(
+	df_stores, geometry=gpd.points_from_xy(df_stores.easting,
+										   df_stores.northing),
+	crs='EPSG:27700')
 geo_stores['markersize'] = geo_stores.footage/100
 
 
 
-# Read in study_area shapefile
+# Read in study_area shapefile, indexed by OA11CD so the Flows Matrix
+# (whose rows carry the same index) joins by plain index alignment
 output_areas = gpd.read_file('geographic_data/study_area.shp')
+output_areas = output_areas.set_index('OA11CD')
 leeds = gpd.read_file('geographic_data/Leeds.shp')
 
-# Merge the df_flows DataFrame with the shapefile
-oa_flow = output_areas.merge(df_flow, left_on='OA11CD', right_index=True)
+# Join the df_flow DataFrame with the shapefile
+oa_flow = output_areas.join(df_flow, how='inner')
+
 
+# Classify the spend values once; the Spend column comes from the
+# shapefile and never changes, so every map reuses the same class breaks
+spend_bins = mapclassify.FisherJenks(oa_flow['Spend'], k=5).bins
+# FisherJenks.bins holds only the five upper class edges; prepend the
+# data minimum so BoundaryNorm keeps all five classes distinct
+spend_edges = [oa_flow['Spend'].min()] + list(spend_bins)
+spend_norm = BoundaryNorm(spend_edges, plt.get_cmap('Greens').N)
 
 # Plot the map layers
 fig, ax = plt.subplots(1, figsize=(15,15))
 leeds.plot(ax=ax, facecolor='none', linewidth=2, edgecolor='black')
-oa_flow.plot(ax=ax, column='Spend', cmap='Greens', scheme='fisher_jenks',
+oa_flow.plot(ax=ax, column='Spend', cmap='Greens', norm=spend_norm,
 			 linewidth=0.1, edgecolor='gray', alpha=0.7)
 
 geo_stores.plot(ax=ax, column='brand', markersize='markersize')
@@ -245,6 +237,13 @@ appropriate file formats
 task = input('Do you want to open a new store? \nIf yes, insert y, otherwise\
 insert any key and press enter: ')
 
+if task == 'y':
+	# The Leeds boundary never changes between iterations; render it once
+	# and only swap the chloropleth and store layers on each try
+	base_fig, base_ax = plt.subplots(1, figsize=(15,15))
+	leeds.plot(ax=base_ax, facecolor='none', linewidth=2, edgecolor='black')
+	base_layers = len(base_ax.collections)
+
 while task == 'y':
 	store_name = input("Insert the new store's name, without_spaces: ")
 	#Tesco
@@ -255,14 +254,17 @@ while task == 'y':
 	store_n = input("insert the northing coordinate value: ")
 	#12000
 	store_footage = input("Insert the area of your store in suare feet: ")
-	my_store = retailmodel.Stores(name=store_name, brand=my_brand,
-								  easting=store_e, northing=store_n,
-								  footage=store_footage)
-	new_stores = stores.copy()
-	new_stores.append(my_store)
-
-	new_df_flow = retailmodel.DemandZones.comp_flow(demand_zones, new_stores,
-													alphas, betas)
+	my_store = retailmodel.Stores.from_user_input(name=store_name,
+								  brand=my_brand, easting=store_e,
+								  northing=store_n, footage=store_footage)
+	# Only the new store's column needs computing; the existing columns
+	# are reused from the cached model arrays on df_flow, and the new
+	# column itself is memoized on the store's rounded signature
+	num_col = new_store_num(round(my_store.easting),
+							round(my_store.northing), my_store.brand,
+							my_store.footage)
+	new_df_flow = retailmodel.comp_new_store_flow(df_flow, my_store, alphas,
+												  num_col=num_col)
 
 
 	brand_revenue = retailmodel.Brands.comp_brand_revenue(my_brand, df_flow)
@@ -284,50 +286,38 @@ while task == 'y':
 
 	"""
 
-	# Create an empty list
-	new_stores_list = []
-	for store in new_stores:
-		name = store.name
-		brand = store.brand
-		easting = store.easting
-		northing = store.northing
-		footage = store.footage
-
-		geo_store = [name, brand, easting, northing, footage]
-
-		new_stores_list.append(geo_store)
-
-
-	# Define attribute fields
-	#store_attr = ['name', 'brand', 'easting', 'northing', 'footage']
-
-	# Construct a DataFrame object from the new_geo_stores list
-	new_df_stores = pd.DataFrame(new_stores_list, columns=store_attr)
-
-	# Create a 'Coordinates' tuple from the easting and northing values
-	new_df_stores['Coordinates'] = list(zip(new_df_stores.easting,
-									    new_df_stores.northing))
-
-	# Convert the 'Coordinates' tuples to point geometry
-	new_df_stores['Coordinates'] = (
-		new_df_stores['Coordinates'].apply(shapely.geometry.Point))
-
-	# Construct a GeoDataFrame from new_df_stores
-	new_geo_stores = gpd.GeoDataFrame(new_df_stores, geometry='Coordinates')
-	new_geo_stores['markersize'] = new_geo_stores.footage/100
-
-	# Merge the new_df_flows object with the shapefile
-	new_oa_flow = output_areas.merge(new_df_flow, left_on='OA11CD',
-									 right_index=True)
-
-	# Plot the map layers
-
-	new_fig, ax = plt.subplots(1, figsize=(15,15))
-	leeds.plot(ax=ax, facecolor='none', linewidth=2, edgecolor='black')
-	new_oa_flow.plot(ax=ax, column='Spend', cmap='Greens',
-				     scheme='fisher_jenks', alpha=0.7)
-	new_geo_stores.plot(ax=ax, column='brand', markersize='markersize')
-	ax.set_title('Supply & Demand after New Store')
+	# The existing stores layer never changes; build a one-row
+	# GeoDataFrame for the new store and append it to geo_stores
+	new_store_row = gpd.GeoDataFrame(
+		{'name': [my_store.name], 'brand': [my_store.brand],
+		 'easting': [my_store.easting], 'northing': [my_store.northing],
+		 'footage': [my_store.footage],
+		 'markersize': [my_store.footage / 100]},
+		geometry=gpd.points_from_xy([my_store.easting],
+									[my_store.northing]),
+		crs=geo_stores.crs)
+	new_geo_stores = pd.concat([geo_stores, new_store_row],
+							   ignore_index=True)
+
+	# Join the new_df_flow object with the shapefile
+	new_oa_flow = output_areas.join(new_df_flow, how='inner')
+
+	# Plot the map layers on the cached base figure. Closing the window
+	# destroys the figure's manager and unregisters it from pyplot, so
+	# rebuild the base figure and Leeds boundary if that happened;
+	# otherwise just drop the previous iteration's dynamic layers
+	if not plt.fignum_exists(base_fig.number):
+		base_fig, base_ax = plt.subplots(1, figsize=(15,15))
+		leeds.plot(ax=base_ax, facecolor='none', linewidth=2,
+				   edgecolor='black')
+		base_layers = len(base_ax.collections)
+	for layer in list(base_ax.collections[base_layers:]):
+		layer.remove()
+	new_oa_flow.plot(ax=base_ax, column='Spend', cmap='Greens',
+				     norm=spend_norm, alpha=0.7)
+	new_geo_stores.plot(ax=base_ax, column='brand',
+						markersize='markersize')
+	base_ax.set_title('Supply & Demand after New Store')
 	plt.show()
 
 	"""
@@ -335,7 +325,7 @@ while task == 'y':
 	canibalization.
 	"""
 
-	store_revenue = new_df_flow.loc['Store_Revenue'][my_store.name]
+	store_revenue = new_df_flow.attrs['store_revenue'][my_store.name]
 	trading_in =store_revenue/my_store.footage
 	new_brand_revenue = retailmodel.Brands.comp_brand_revenue(
 			my_brand, new_df_flow)
@@ -353,7 +343,7 @@ while task == 'y':
 	# column=my_store.name to access New Store's column in the Flows Matrix
 	new_oa_flow.plot(ax=ax, column=my_store.name, cmap='Greens', scheme=\
 				    'fisher_jenks', alpha=0.7)
-	geo_store = new_geo_stores.loc[135:]
+	geo_store = new_geo_stores.iloc[-1:] # New Store is the appended row
 	geo_store.plot(ax=ax, markersize='markersize')
 	ax.set_title('New Store')
 	plt.show()
@@ -1,10 +1,88 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 
+try:
+	from numba import njit, prange
+except ImportError: # Numba is optional; comp_flow falls back to NumPy
+	njit = None
+
+
+if njit is not None:
+	@njit(parallel=True, fastmath=True)
+	def _flows_kernel(ze, zn, beta, se, sn, foot, alpha, num, S):
+		"""
+		Fill num with the SIM numerators W*exp(-beta*d) and S with their
+		row sums, one zone row per prange iteration.
+
+		Streams each zone row in a single pass (distance, attraction,
+		deterrence and row sum) so no distance or exponent temporaries
+		are allocated. The caller normalizes num by O/S to get flows.
+		"""
+		nz = ze.shape[0]
+		ns = se.shape[0]
+		w = np.empty(ns, dtype=foot.dtype)
+		for j in range(ns):
+			w[j] = foot[j] ** alpha[j]
+		for i in prange(nz):
+			s = 0.0
+			for j in range(ns):
+				dx = ze[i] - se[j]
+				dy = zn[i] - sn[j]
+				d = np.sqrt(dx * dx + dy * dy) * 0.001
+				t = w[j] * np.exp(-beta[i] * d)
+				num[i, j] = t
+				s += t
+			S[i] = s
+
+
+
+
 
 
 
 
+# Smallest zone count worth the process start-up cost of the parallel
+# NumPy fallback in comp_flow
+_MIN_PARALLEL_ZONES = 10000
+
+
+def _comp_num(ze, zn, beta, se, sn, foot, alpha):
+	"""
+	Return the SIM numerators W*exp(-beta*d) and their row sums for a
+	block of zones, as a (num, S) tuple of NumPy arrays.
+	"""
+	# Zone-to-store distance matrix in kilometers, computed with the
+	# dot-product identity (a-b)^2 = a.a - 2a.b + b.b so the heavy cross
+	# term is a single BLAS matrix multiplication. The coordinates are
+	# centred first: distances are unchanged but the squared terms stay
+	# small enough for float32 not to lose the difference
+	ce = np.float32((ze.mean() + se.mean()) / 2)
+	cn = np.float32((zn.mean() + sn.mean()) / 2)
+	Z = np.column_stack([ze - ce, zn - cn])
+	C = np.column_stack([se - ce, sn - cn])
+	zz = np.einsum('ij,ij->i', Z, Z)
+	ss = np.einsum('ij,ij->i', C, C)
+	D2 = zz[:, None] + ss[None, :] - 2.0 * (Z @ C.T)
+	np.maximum(D2, 0, out=D2) # clip rounding-error negatives
+	D = np.sqrt(D2) / 1000
+	# Store attraction and deterrence numerators with their row sums
+	# (the inverse of the balancing Ai term). The exponential is one
+	# bulk call on a contiguous buffer, reusing D in place rather than
+	# allocating temporaries
+	W = foot ** alpha
+	num = np.multiply(-beta[:, None], D, out=D)
+	np.exp(num, out=num)
+	num *= W[None, :]
+	return num, num.sum(axis=1)
+
+
+def _comp_num_chunk(args):
+	"""Unpack a _comp_num argument tuple; ProcessPoolExecutor helper."""
+	return _comp_num(*args)
+
 
 
 
@@ -16,13 +94,26 @@ class Stores:
 		easting - easting of the store's centroid (float)
 		northing - northing value of the store centroid (float)
 		footage - area of the store in square feet (integer)
+
+		The numeric arguments are expected already typed (as read_csv
+		returns them); use Stores.from_user_input() for raw strings.
 		"""
 		self.name = name
 		self.brand = brand
-		self.footage = int(footage)
-		self.easting = float(easting)
-		self.northing = float(northing)
-		self.location = [float(self.easting), float(self.northing)]
+		self.footage = footage
+		self.easting = easting
+		self.northing = northing
+		self.location = [self.easting, self.northing]
+
+
+	@classmethod
+	def from_user_input(cls, name, brand, easting, northing, footage):
+		"""
+		Return a Stores object built from raw (string) field values,
+		coercing the coordinates and footage to their numeric types.
+		"""
+		return cls(name, brand, float(easting), float(northing),
+				   int(footage))
 
 
 	def __str__(self):
@@ -59,9 +150,55 @@ str(self.brand) + "\nFloorspace: " + str(self.footage) + " sq.feet"
 
 		"""
 		self.flow = flows
-		return self.flow.loc['Store_Revenue'][self.name]
+		return self.flow.attrs['store_revenue'][self.name]
+
+
+
+
+
+
+class StoreTable:
+	def __init__(self, stores, alphas):
+		"""
+		Structure-of-arrays view over the supply side.
+
+		stores - list of Stores objects
+		alphas - dictionary relating every brand to its relative
+				 attractiveness parameter
 
+		The numeric store attributes are held in contiguous NumPy arrays
+		(one entry per store, in list order) so the flow computation can
+		work on whole columns instead of attribute lookups per object.
+		"""
+		self.names = [store.name for store in stores]
+		self.brand = np.array([store.brand for store in stores],
+							  dtype=object)
+		# float32 halves the memory traffic of the flows kernel and is
+		# well beyond the precision of the model parameters
+		self.easting = np.array([store.easting for store in stores],
+								dtype=np.float32)
+		self.northing = np.array([store.northing for store in stores],
+								 dtype=np.float32)
+		self.footage = np.array([store.footage for store in stores],
+								dtype=np.float32)
+		self.alpha = np.array([float(alphas[store.brand])
+							   for store in stores], dtype=np.float32)
+
+	def __len__(self):
+		return len(self.names)
+
+	def __getitem__(self, i):
+		"""Return a Stores view of the i-th row of the table."""
+		return Stores(self.names[i], self.brand[i],
+					  float(self.easting[i]), float(self.northing[i]),
+					  int(self.footage[i]))
+
+	def __iter__(self):
+		for i in range(len(self.names)):
+			yield self[i]
 
+	def __str__(self):
+		return "StoreTable of " + str(len(self)) + " stores"
 
 
 
@@ -88,11 +225,9 @@ class Brands:
 		returns:
 		Total revenue of all the stores belonging to the self brand -> float
 		"""
-		brand_revenue = 0
-		for store in flows.columns[1:]:
-			if flows.loc['Brand_Name'][store] == brand:
-				brand_revenue += flows.loc['Store_Revenue'][store]
-		return brand_revenue
+		brand_of = flows.attrs['brand_of']
+		revenue = flows.attrs['store_revenue']
+		return float(revenue[brand_of == brand].sum())
 
 
 
@@ -103,18 +238,26 @@ class Brands:
 
 
 class DemandZones:
-	def __init__(self, OA11CD, expenditure, oac, c_easting, c_northing):
+	def __init__(self, OA11CD, expenditure, oac, c_easting, c_northing,
+				 beta=None):
 		"""
 		OA11CD - Demand Zone code (string)
 		expenditure - amount of spend available in DemandZone per week
 		oac -> open area classification code of DemandZone
 		suppy -> the stores with which the DemandZone interacts (list of Stores)
+		beta - the distance deterrence parameter of the zone's OAC class;
+			   caching it here saves a dictionary lookup per zone in
+			   comp_flow (optional, looked up from betas when absent)
+
+		expenditure and the centroid coordinates are expected already
+		typed, as read_csv returns them.
 		"""
 		self.OA11CD = OA11CD
-		self.expenditure = float(expenditure)
+		self.expenditure = expenditure
 		self.oac = oac
-		self.c_easting = float(c_easting)
-		self.c_northing = float(c_northing)
+		self.c_easting = c_easting
+		self.c_northing = c_northing
+		self.beta = beta
 
 	def __str__(self):
 		return "OA11CD: " + str(self.OA11CD) + "\nSpend: " + \
@@ -179,56 +322,104 @@ str(self.expenditure) + " Pounds Sterling per week"
 		each DemandZones object to every Stores object.
 
 		arguments:
-		stores -> list of Stores objects
+		stores -> list of Stores objects, or a StoreTable
 		alphas -> dictionary relating every brand to its relative
 				  attractiveness parameter
 	    betas -> dictionary relating each OAC class to its distance deterance
 				 parameter
 
 	    returns:
-		Flows Matrix -> pandas DataFrame
+		Flows Matrix -> pandas DataFrame of floats, with one row per
+					    OA11CD and one column per store. The brand of
+					    each store and the total revenue per store are
+					    attached as pandas Series under
+					    attrs['brand_of'] and attrs['store_revenue']
 		"""
 		if isinstance(self, DemandZones):
-			self.zone_flow = []
-			Ai = self.comp_ai(stores, betas[self.oac], alphas)
+			# Attraction weights are per-store constants; compute them once
+			# instead of once per loop iteration
+			w = {store.name: store.footage ** float(alphas[store.brand])
+				 for store in stores}
+			beta = self.beta if self.beta is not None else betas[self.oac]
 			O = self.expenditure
+			# Accumulate the numerators and their sum in one pass, then
+			# normalize; identical to computing Ai with comp_ai first but
+			# with half the distance and exp work
+			numerators = []
+			s = 0.0
 			for store in stores:
-				W = store.footage ** alphas[store.brand]
-				C = self.dist_to_store(store)
-				X = betas[self.oac] * C
-				f = Ai * O * W * np.exp(-X)
-				self.zone_flow.append(f)
+				t = w[store.name] \
+					* np.exp(-beta * self.dist_to_store(store))
+				numerators.append(t)
+				s += t
+			self.zone_flow = [O * t / s for t in numerators]
 			return self.zone_flow
 		elif isinstance(self, list):
-			flows = []
-
-			brand_names = []
-			for store in stores: # to have a brands row in output
-				brand_names.append(store.brand)
-#				flows.append(brand_names)
-			for i in range(len(self)):
-				zone_flow = []
-				Ai = self[i].comp_ai(stores, betas[self[i].oac], alphas)
-				O = self[i].expenditure
-				for store in stores:
-					W = store.footage ** alphas[store.brand]
-					C = self[i].dist_to_store(store)
-					X = betas[self[i].oac] * C
-					f = Ai * O * W * np.exp(-X)
-					zone_flow.append(f)
-				flows.append(zone_flow)
-			columns = []
-			for store in stores:
-				columns.append(store.name)
-
-			indecies = ['Brand_Name'] # brands row under store name
-			for zone in self:
-				indecies.append(zone.OA11CD)
-			indecies.append('Store_Revenue')
-			revenue = [sum(x) for x in zip(*flows)]
-			flows.append(revenue)
-			flows.insert(0,brand_names)
-			return pd.DataFrame(flows, columns=columns, index=indecies)
+			# Gather the zone and store attributes into NumPy arrays once,
+			# then compute the whole Flows Matrix with broadcasted array
+			# operations instead of looping over every (zone, store) pair
+			ze = np.array([zone.c_easting for zone in self],
+						  dtype=np.float32)
+			zn = np.array([zone.c_northing for zone in self],
+						  dtype=np.float32)
+			O = np.array([zone.expenditure for zone in self],
+						 dtype=np.float32)
+			# Prefer the beta cached on each zone, falling back to the
+			# betas dictionary for zones built without one
+			beta_vec = np.array([zone.beta if zone.beta is not None
+								 else betas[zone.oac] for zone in self],
+								dtype=np.float32)
+
+			# The supply side may come in as a StoreTable already; lists of
+			# Stores objects are gathered into one on the fly
+			if isinstance(stores, StoreTable):
+				table = stores
+			else:
+				table = StoreTable(stores, alphas)
+			se = table.easting
+			sn = table.northing
+			foot = table.footage
+			alpha_vec = table.alpha
+
+			nz = len(self)
+			workers = os.cpu_count() or 1
+			if njit is not None:
+				# Fused Numba kernel: one streaming pass per zone row,
+				# parallelized over zones, with no full-matrix temporaries
+				num = np.empty((nz, len(table)), dtype=np.float32)
+				S = np.empty(nz, dtype=np.float32)
+				_flows_kernel(ze, zn, beta_vec, se, sn, foot,
+							  alpha_vec, num, S)
+			elif workers > 1 and nz >= _MIN_PARALLEL_ZONES:
+				# Without Numba, the zone rows are still independent:
+				# split them into one chunk per core and compute the
+				# chunks in worker processes
+				chunks = np.array_split(np.arange(nz), workers)
+				args = [(ze[c], zn[c], beta_vec[c], se, sn, foot,
+						 alpha_vec) for c in chunks]
+				with ProcessPoolExecutor(workers) as executor:
+					parts = list(executor.map(_comp_num_chunk, args))
+				num = np.concatenate([part[0] for part in parts])
+				S = np.concatenate([part[1] for part in parts])
+			else:
+				num, S = _comp_num(ze, zn, beta_vec, se, sn, foot,
+								   alpha_vec)
+			flows = (O / S)[:, None] * num
+
+			# Keep the matrix purely numeric; the store brands and the
+			# per-store revenue totals travel along as Series in attrs
+			indecies = [zone.OA11CD for zone in self]
+			df = pd.DataFrame(flows, columns=table.names, index=indecies,
+							  copy=False)
+			df.attrs['brand_of'] = pd.Series(table.brand,
+											 index=table.names)
+			df.attrs['store_revenue'] = pd.Series(flows.sum(axis=0),
+												  index=table.names)
+			# Cache the model arrays so a what-if store can be appended
+			# incrementally (see comp_new_store_flow)
+			df.attrs['model'] = {'ze': ze, 'zn': zn, 'beta': beta_vec,
+								 'O': O, 'num': num, 'S': S}
+			return df
 		else:
 			raise Exception('DataType Error: Make sure the self argument\
  is either a DemandZones object or a list of DemandZones objects; the stores\
@@ -243,6 +434,78 @@ str(self.expenditure) + " Pounds Sterling per week"
 
 
 
+def comp_store_num(flows, easting, northing, brand, footage, alphas):
+	"""
+	Return the numerator column W*exp(-beta*d) of a candidate store
+	against every zone of the given Flows Matrix.
+
+	arguments:
+	flows -> Flows Matrix returned by DemandZones.comp_flow() for a list
+			 of zones
+	easting, northing -> coordinates of the candidate store (floats)
+	brand -> brand of the candidate store (string)
+	footage -> area of the candidate store in square feet (integer)
+	alphas -> dictionary relating every brand to its relative
+			  attractiveness parameter
+
+	returns:
+	numerator column, one entry per zone -> 1D NumPy array
+	"""
+	model = flows.attrs['model']
+	w = footage ** float(alphas[brand])
+	d = np.sqrt((model['ze'] - easting) ** 2
+				+ (model['zn'] - northing) ** 2) / 1000
+	return w * np.exp(-model['beta'] * d)
+
+
+def comp_new_store_flow(flows, new_store, alphas, num_col=None):
+	"""
+	Return the Flows Matrix extended with one extra store.
+
+	Only the new store's numerator column is computed from scratch; the
+	columns of the existing stores are reused from the model arrays cached
+	on the Flows Matrix, so the update costs O(n_zones) instead of a full
+	O(n_zones * n_stores) recompute.
+
+	arguments:
+	flows -> Flows Matrix returned by DemandZones.comp_flow() for a list
+			 of zones
+	new_store -> Stores object to add to the supply side
+	alphas -> dictionary relating every brand to its relative
+			  attractiveness parameter
+	num_col -> the new store's numerator column, if already computed
+			   (e.g. from a memoizing wrapper around comp_store_num);
+			   computed here when None
+
+	returns:
+	Flows Matrix including new_store -> pandas DataFrame, same layout and
+										attrs as DemandZones.comp_flow()
+	"""
+	model = flows.attrs['model']
+	if num_col is None:
+		num_col = comp_store_num(flows, new_store.easting,
+								 new_store.northing, new_store.brand,
+								 new_store.footage, alphas)
+	num = np.concatenate([model['num'], num_col[:, None]], axis=1)
+	S = model['S'] + num_col
+	new_flows = (model['O'] / S)[:, None] * num
+
+	columns = list(flows.columns) + [new_store.name]
+	df = pd.DataFrame(new_flows, columns=columns, index=flows.index,
+					  copy=False)
+	df.attrs['brand_of'] = pd.concat([flows.attrs['brand_of'],
+									  pd.Series([new_store.brand],
+												index=[new_store.name])])
+	df.attrs['store_revenue'] = pd.Series(new_flows.sum(axis=0),
+										  index=columns)
+	df.attrs['model'] = {'ze': model['ze'], 'zn': model['zn'],
+						 'beta': model['beta'], 'O': model['O'],
+						 'num': num, 'S': S}
+	return df
+
+
+
+
 class OAC:
 	def __init__(self, class_no, name, beta):
 		self.name = name